@@ -7,8 +7,10 @@ This module defines the main WSGI application class.
 import re
 import sys
 import os
+import time
 import pkgutil
 import logging
+import threading
 from functools import update_wrapper
 
 from webob import Request, Response
@@ -18,8 +20,8 @@ from webob import Request, Response
 # TODO: Namake's Request and Response objects.
 
 from .config import Config
+from .extensions import ExtensionRegistry
 
-# TODO: Defer logging setup?
 logger = logging.getLogger(__name__)
 
 __all__ = (
@@ -71,12 +73,26 @@ def repl_start_response(start_response, parent_exc_info):
         return start_response(status, headers, exc_info)
     return _wrapped
 
+def get_charset(headerlist):
+    """
+    Returns the charset of the Content-Type header in the given
+    header list or `None` if it doesn't have one.
+    """
+    for name, value in headerlist:
+        if name.lower() == 'content-type':
+            for param in value.split(';')[1:]:
+                key, sep, charset = param.strip().partition('=')
+                if key.lower() == 'charset' and charset:
+                    return charset.strip('"')
+    return None
+
 def setupmethod(f):
     """Wraps a method so that it performs a check in debug mode if the
     first request was already handled.
     """
     def wrapper_func(self, *args, **kwargs):
-        if self.config['DEBUG'] and self._got_first_request:
+        if (self.config['DEBUG'] and self._got_first_request and
+                not self.extensions.is_loading()):
             raise AssertionError('A setup function was called after the '
                 'first request was handled.  This usually indicates a bug '
                 'in the application where a module was not imported '
@@ -97,20 +113,30 @@ class Application(object):
     def __init__(self, import_name):
         self.routes = []
         self.controller_cache = {}
-        self.extensions = {}
+        self.extensions = ExtensionRegistry(self)
         self._error_handlers = {}
         self._got_first_request = False
+        self._first_request_lock = threading.Lock()
         self._before_request_funcs = []
         self._after_request_funcs = []
+        self._default_headerlist = None
         self.root_path = get_root_path(import_name)
         self.config = Config(self.root_path, 
                              defaults=self.get_default_config())
 
-        # Setup basic logging.
+    def setup_logging(self):
+        """
+        Sets up basic logging unless logging has already been configured.
+        Records are written as JSON on a background thread so that
+        requests never wait on logging. This is called before the first
+        request so that the logging module isn't set up at startup.
+        """
         if not logging.root.handlers and logger.level == logging.NOTSET:
+            from .log import AsyncHandler, JSONFormatter
             logger.setLevel(logging.DEBUG)
-            handler = logging.StreamHandler()
-            logger.addHandler(handler)
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(JSONFormatter())
+            logger.addHandler(AsyncHandler(stream_handler))
 
     def get_default_config(self):
         """
@@ -134,8 +160,30 @@ class Application(object):
                             controller,
                             kwargs))
 
+    def __getattr__(self, name):
+        """
+        Looks up extensions that were registered by import path but
+        haven't been loaded yet so that ``app.jinja2`` etc. work
+        regardless of whether the extension has been loaded.
+        """
+        extensions = self.__dict__.get('extensions')
+        if extensions is not None and name in extensions:
+            return extensions[name]
+        raise AttributeError(name)
+
     def __call__(self, environ, start_response):
         """Shortcut for :attr:`wsgi_app`."""
+        if not self._got_first_request:
+            with self._first_request_lock:
+                # Check again in case another thread
+                # did the setup while we waited.
+                if not self._got_first_request:
+                    self.setup_logging()
+                    # Load extensions that hook into requests before the
+                    # first request so that any middleware they add is
+                    # in place.
+                    self.extensions.load_request_extensions()
+                    self._got_first_request = True
         return self.wsgi_app(environ, start_response)
 
     def wsgi_app(self, environ, start_response):
@@ -161,6 +209,7 @@ class Application(object):
                                a list of headers and an optional
                                exception context to start the response
         """
+        start = time.time()
         request = self.request_class(environ)
 
         # Mark the app as having received it's first request.
@@ -170,49 +219,114 @@ class Application(object):
         # request handler has a copy of it.
         request.app = self
 
+        # Keep the status that is actually sent, which can differ from
+        # the response's status, as for a 304 to a conditional request.
+        sent_status = []
+        server_start_response = start_response
+        def start_response(status, headers, exc_info=None):
+            sent_status[:] = [status]
+            return server_start_response(status, headers, exc_info)
+
         # Preprocess the request calling all before_request functions.
         rv = self.preprocess_request(request)
-        if rv:
-            return self.make_response(request, rv)
+        response = None
+        try:
+            try:
+                if rv:
+                    response = self.make_response(request, rv)
+                else:
+                    response = self.dispatch_request(request)
+                # Call the response here so that errors raised while
+                # rendering it are handled like errors in the controller.
+                return response(environ, start_response)
+            except Exception, e:
+                # An exception has occurred. 
+                exc_info = sys.exc_info()
+                response = self.handle_exception(request, e, exc_info)
+
+                # HTTP exceptions such as 404s are normal responses so only
+                # pass the exc_info to the server for unexpected errors.
+                from webob import exc
+                if not isinstance(e, exc.HTTPException):
+                    start_response = repl_start_response(start_response, exc_info)
+                return response(environ, start_response)
+        finally:
+            if sent_status:
+                status = sent_status[0]
+            elif response is not None:
+                status = response.status
+            else:
+                # The error wasn't handled so the server responds with a 500.
+                status = '500 Internal Server Error'
+            self.log_request(request, status, time.time() - start)
+
+    def log_request(self, request, status, latency):
+        """
+        Logs a request along with the route that handled it and
+        the time it took in seconds. The time includes calling the
+        response but not the server iterating over the body, so the
+        time spent streaming a generated body isn't included.
+        """
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('%s %s %s', request.method, request.path_qs,
+                        status, extra={
+                            'route': request.environ.get('namake.route'),
+                            'latency': round(latency, 6),
+                        })
+
+    def dispatch_request(self, request, after_request_funcs=True):
+        """
+        Matches the request against the routing table and returns the
+        response from the matching controller. Raises
+        :class:`webob.exc.HTTPNotFound` if no route matches.
 
+        Unlike :meth:`wsgi_app` this doesn't run the before_request
+        functions or handle exceptions so that requests can be dispatched
+        in-process, for instance as part of a batch request.
+        """
         for regex, name, controller_path, kwargs in self.routes:
             match = regex.match(request.path_info)
             if match:
-                # Get the proper controller
-                try:
-                    controller = self.controller_cache.pop(controller_path, None)
-                    if not controller:
-                        if hasattr(controller_path, '__call__'):
-                            # The given controller is already a callable. Just use it.
-                            controller = controller_path
-                            self.controller_cache[controller_path] = controller
-                        else:
-                            # The controller module hasn't been loaded yet.
-                            # Load it here.
-                            from .utils.module import import_string
-                            controller = import_string(controller_path)
-
-                    # If there are any named groups, use those as kwargs, ignoring
-                    # non-named groups.
-                    urlkwargs = match.groupdict()
-
-                    # Pass any extra_kwargs as **kwargs.
-                    if kwargs:
-                        urlkwargs.update(kwargs)
-
-                    # Call the request handler and return the response.
-                    response = self.handle_request(request, controller, urlkwargs)
-                    return response(environ, start_response)
-                except Exception, e:
-                    # An exception has occurred. 
-                    exc_info = sys.exc_info()
-                    response = self.handle_exception(request, e, exc_info)
-                    start_response = repl_start_response(start_response, exc_info)
-                    return response(environ, start_response)
+                # Record the matched route so that middleware can
+                # report per-route information.
+                request.environ['namake.route'] = name or regex.pattern
+
+                controller = self.get_controller(controller_path)
+
+                # If there are any named groups, use those as kwargs, ignoring
+                # non-named groups.
+                urlkwargs = match.groupdict()
+
+                # Pass any extra_kwargs as **kwargs.
+                if kwargs:
+                    urlkwargs.update(kwargs)
+
+                # Call the request handler and return the response.
+                return self.handle_request(request, controller, urlkwargs,
+                                           after_request_funcs)
 
         # No matching URLs. Return A 404.
         from webob import exc
-        return self.handle_exception(request, exc.HTTPNotFound())(environ, start_response)
+        raise exc.HTTPNotFound()
+
+    def get_controller(self, controller_path):
+        """
+        Returns the controller for the given import path or callable.
+        Controllers given by import path are imported the first time
+        they are used and cached in :attr:`controller_cache`.
+        """
+        controller = self.controller_cache.get(controller_path)
+        if controller is None:
+            if hasattr(controller_path, '__call__'):
+                # The given controller is already a callable. Just use it.
+                controller = controller_path
+            else:
+                # The controller module hasn't been loaded yet.
+                # Load it here.
+                from .utils.module import import_string
+                controller = import_string(controller_path)
+            self.controller_cache[controller_path] = controller
+        return controller
 
     @setupmethod
     def before_request(self, f):
@@ -248,11 +362,13 @@ class Application(object):
             if rv:
                 return rv
     
-    def handle_request(self, request, controller, kwargs):
+    def handle_request(self, request, controller, kwargs,
+                       after_request_funcs=True):
         """
         Handles a request via the given controller.
         """
-        return self.make_response(request, controller(request, **kwargs))
+        return self.make_response(request, controller(request, **kwargs),
+                                  after_request_funcs)
 
     @setupmethod
     def register_error_handler(self, code, f):
@@ -262,7 +378,8 @@ class Application(object):
         """
         self._error_handlers[code] = f
 
-    def handle_exception(self, request, e, exc_info=None):
+    def handle_exception(self, request, e, exc_info=None,
+                         after_request_funcs=True):
         """
         Handles an exception within the application.
         If a corresponding handler is registered with the application
@@ -271,7 +388,8 @@ class Application(object):
         from webob import exc
         if isinstance(e, exc.HTTPException):
             if isinstance(e, exc.HTTPServerError):
-                logger.error('HTTP Server Error: "%s"' % e, exc_info=1)
+                logger.error('HTTP Server Error: "%s"' % e, exc_info=1,
+                             extra={'route': request.environ.get('namake.route')})
             status = e.code 
         else:
             # If in debug mode show the debug error page.
@@ -287,15 +405,16 @@ class Application(object):
                     raise e
             
             # Otherwise return a normal HttpInternalServerError
-            logger.error('Internal Server Error: "%s"' % e, exc_info=1)
+            logger.error('Internal Server Error: "%s"' % e, exc_info=1,
+                         extra={'route': request.environ.get('namake.route')})
             status = 500
             e = exc.HTTPInternalServerError()
         
         handler = self._error_handlers.get(status)
         if handler:
-            return self.make_response(request, handler(e))
+            return self.make_response(request, handler(e), after_request_funcs)
         else:
-            return self.make_response(request, e)
+            return self.make_response(request, e, after_request_funcs)
 
     def make_response(self, request, rv, after_request_funcs=True):
         """Converts the return value from a view function to a real
@@ -333,13 +452,12 @@ class Application(object):
         if rv is None:
             raise ValueError('View function did not return a response')
 
+        if isinstance(headers, dict):
+            headers = headers.items()
+
         if not isinstance(rv, self.response_class):
-            # When we create a response object directly, we let the constructor
-            # set the headers and status.  We do this because there can be
-            # some extra logic involved when creating these objects with
-            # specific values (like defualt content type selection).
             if isinstance(rv, basestring):
-                rv = self.response_class(rv, headerlist=headers, status=status)
+                rv = self.make_string_response(rv, status, headers)
                 headers = status = None
 
         if status is not None:
@@ -357,4 +475,60 @@ class Application(object):
                 if after_rv:
                     return self.make_response(request, after_rv, False)
 
-        return rv
+        return self.finalize_response(request, rv)
+
+    @property
+    def default_headerlist(self):
+        """
+        The headers that responses created from strings start with.
+        These are computed once from a default :attr:`response_class`
+        object rather than for every response.
+        """
+        if self._default_headerlist is None:
+            self._default_headerlist = tuple(
+                (name, value)
+                for name, value in self.response_class().headerlist
+                if name.lower() != 'content-length')
+        return self._default_headerlist
+
+    def make_string_response(self, body, status=None, headers=None):
+        """
+        Creates a :attr:`response_class` object with the given string
+        as body. `unicode` bodies are encoded only once, here, using the
+        charset of the response's Content-Type header or the default
+        charset of the response class.
+        """
+        if headers:
+            names = set(name.lower() for name, value in headers)
+            headerlist = [(name, value) for name, value in self.default_headerlist
+                          if name.lower() not in names]
+            headerlist.extend(headers)
+        else:
+            names = ()
+            headerlist = list(self.default_headerlist)
+
+        if isinstance(body, unicode):
+            body = body.encode(get_charset(headerlist) or
+                               self.response_class.default_charset)
+
+        if 'content-length' not in names:
+            headerlist.append(('Content-Length', str(len(body))))
+
+        return self.response_class(app_iter=[body], headerlist=headerlist,
+                                   status=status)
+
+    def finalize_response(self, request, response):
+        """
+        Finalizes a response before it is returned to the server. The
+        Content-Length header is set for responses whose body length is
+        known without consuming the body so that servers can keep the
+        connection alive rather than using chunked encoding or closing it.
+
+        Responses with bodies that are generated lazily by an iterator
+        are left unchanged so that they are still streamed.
+        """
+        if response.content_length is None:
+            app_iter = response.app_iter
+            if isinstance(app_iter, (list, tuple)):
+                response.content_length = sum(len(chunk) for chunk in app_iter)
+        return response
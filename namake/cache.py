@@ -0,0 +1,390 @@
+"""
+The cache module for Namake.
+
+This module defines simple cache backends and an extension for
+attaching a cache to an application.
+"""
+
+import os
+import time
+import struct
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .app import logger
+
+__all__ = (
+    'BaseCache',
+    'SimpleCache',
+    'MMapCache',
+    'Cache',
+)
+
+class BaseCache(object):
+    """
+    The base class for cache backends. Backends store arbitrary picklable
+    values under string keys. The interface is compatible with the memcache
+    client interface so backends can be used anywhere a memcache client
+    is expected.
+
+    :param default_timeout: the number of seconds values are kept when
+                            no timeout is given. 0 means forever.
+    """
+
+    def __init__(self, default_timeout=300):
+        self.default_timeout = default_timeout
+
+    def get(self, key):
+        """
+        Returns the value stored for `key` or `None` if
+        it isn't in the cache.
+        """
+        return None
+
+    def set(self, key, value, timeout=None):
+        """
+        Stores `value` under `key`. Returns `True` if the value
+        was stored.
+        """
+        return False
+
+    def delete(self, key):
+        """
+        Removes `key` from the cache.
+        """
+        pass
+
+    def clear(self):
+        """
+        Removes all values from the cache.
+        """
+        pass
+
+    def _get_expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if not timeout:
+            return 0
+        return time.time() + timeout
+
+
+class SimpleCache(BaseCache):
+    """
+    A cache that stores values in a dictionary in the current process.
+    When the cache is full the least recently used values are removed.
+
+    :param max_entries: the maximum number of values to keep.
+    """
+
+    def __init__(self, max_entries=1000, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self.max_entries = max_entries
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, value = entry[0], entry[2]
+            if expires and expires < time.time():
+                del self._cache[key]
+                return None
+            entry[1] = time.time()
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if key not in self._cache and len(self._cache) >= self.max_entries:
+                self._evict()
+            self._cache[key] = [self._get_expires(timeout), time.time(), value]
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _evict(self):
+        now = time.time()
+        for key, (expires, atime, value) in self._cache.items():
+            if expires and expires < now:
+                del self._cache[key]
+        if len(self._cache) >= self.max_entries:
+            # Remove the least recently used tenth of the cache.
+            entries = sorted(self._cache.items(), key=lambda item: item[1][1])
+            for key, entry in entries[:max(1, len(entries) // 10)]:
+                del self._cache[key]
+
+
+class MMapCache(BaseCache):
+    """
+    A cache that stores values in a memory-mapped file so that it can be
+    shared between all worker processes on a host.
+
+    The file holds a fixed size hash table of `slots` slots of `slot_size`
+    bytes each. Each key hashes to a window of `probe` neighbouring slots.
+    When all of them are in use the least recently used slot in the window
+    is replaced.
+
+    Values that don't fit into a single slot, that is whose pickled size
+    plus the length of the key is more than `slot_size` minus a 30 byte
+    slot header, are not cached. :meth:`set` returns `False` for them and
+    they are counted in :attr:`oversized`. Compiled templates and rendered
+    fragments are often larger than the default 4096 bytes, so use a
+    larger `slot_size` when caching them.
+
+    Updates are serialized between processes by locking the file with
+    ``flock`` so the cache only works on Unix-like systems. All processes
+    using the same file must use the same `slots` and `slot_size`.
+    Opening an existing file created with different settings raises a
+    :exc:`RuntimeError`.
+
+    :param path: the path of the cache file. The file is created if
+                 it doesn't exist.
+    :param slots: the number of slots in the hash table.
+    :param slot_size: the size of each slot in bytes including the key.
+    :param probe: the number of slots searched for each key.
+    """
+
+    MAGIC = 'NMKC'
+    VERSION = 1
+
+    # magic, version, slots, slot_size
+    _header = struct.Struct('<4sIII')
+    # hash, expires, last access, value length, key length
+    _slot_header = struct.Struct('<QddIH')
+
+    def __init__(self, path, slots=1024, slot_size=4096, probe=8,
+                 default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        if slot_size <= self._slot_header.size:
+            raise ValueError('slot_size must be larger than %d bytes' %
+                             self._slot_header.size)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probe = min(probe, slots)
+        self.size = self._header.size + slots * slot_size
+        self._map = None
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.oversized = 0
+
+    def _open(self):
+        # File locks are shared between processes that inherit the same
+        # file descriptor so each process needs its own after a fork.
+        if self._pid == os.getpid():
+            return
+
+        import mmap
+        import fcntl
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            expected = self._header.pack(self.MAGIC, self.VERSION,
+                                         self.slots, self.slot_size)
+            if os.fstat(fd).st_size == 0:
+                # The file is new so set it up.
+                os.ftruncate(fd, self.size)
+                os.write(fd, expected)
+            elif (os.read(fd, self._header.size) != expected or
+                    os.fstat(fd).st_size != self.size):
+                # Other processes may have the file mapped so it can't be
+                # resized. Refuse to use it rather than corrupting it.
+                raise RuntimeError('The cache file %s was created with '
+                                   'different settings. Use a different '
+                                   'path or remove the file when no '
+                                   'processes are using it.' % self.path)
+            self._map = mmap.mmap(fd, self.size)
+        except:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            raise
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def _locked(self, f, *args):
+        import fcntl
+
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                return f(*args)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _hash(self, key):
+        from hashlib import md5
+        return struct.unpack('<Q', md5(key).digest()[:8])[0] | 1
+
+    def _offsets(self, keyhash):
+        start = keyhash % self.slots
+        for i in xrange(self.probe):
+            yield self._header.size + ((start + i) % self.slots) * self.slot_size
+
+    def _read_header(self, offset):
+        return self._slot_header.unpack_from(self._map, offset)
+
+    def _find(self, key, keyhash):
+        """
+        Returns the offset of the slot holding `key` or `None`.
+        """
+        for offset in self._offsets(keyhash):
+            slot_hash, expires, atime, vlen, klen = self._read_header(offset)
+            if slot_hash != keyhash:
+                continue
+            start = offset + self._slot_header.size
+            if self._map[start:start + klen] == key:
+                return offset
+        return None
+
+    def _clear_slot(self, offset):
+        self._map[offset:offset + self._slot_header.size] = \
+            '\0' * self._slot_header.size
+
+    def _get(self, key, keyhash):
+        offset = self._find(key, keyhash)
+        if offset is None:
+            return None
+        slot_hash, expires, atime, vlen, klen = self._read_header(offset)
+        now = time.time()
+        if expires and expires < now:
+            self._clear_slot(offset)
+            return None
+        self._slot_header.pack_into(self._map, offset,
+                                    slot_hash, expires, now, vlen, klen)
+        start = offset + self._slot_header.size + klen
+        return self._map[start:start + vlen]
+
+    def _set(self, key, keyhash, value, expires):
+        offset = self._find(key, keyhash)
+        if offset is None:
+            # Pick an empty or expired slot, otherwise replace the
+            # least recently used slot in the window.
+            now = time.time()
+            lru = None
+            for candidate in self._offsets(keyhash):
+                slot_hash, slot_expires, atime, vlen, klen = \
+                    self._read_header(candidate)
+                if not slot_hash or (slot_expires and slot_expires < now):
+                    offset = candidate
+                    break
+                if lru is None or atime < lru[0]:
+                    lru = (atime, candidate)
+            if offset is None:
+                offset = lru[1]
+
+        # Clear the slot and write the header last so that the slot
+        # is never valid with a partially written value.
+        self._clear_slot(offset)
+        start = offset + self._slot_header.size
+        self._map[start:start + len(key) + len(value)] = key + value
+        self._slot_header.pack_into(self._map, offset, keyhash, expires,
+                                    time.time(), len(value), len(key))
+
+    def _delete(self, key, keyhash):
+        offset = self._find(key, keyhash)
+        if offset is not None:
+            self._clear_slot(offset)
+
+    def _clear(self):
+        empty = '\0' * self._slot_header.size
+        for i in xrange(self.slots):
+            offset = self._header.size + i * self.slot_size
+            self._map[offset:offset + self._slot_header.size] = empty
+
+    def _encode_key(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return key
+
+    def get(self, key):
+        key = self._encode_key(key)
+        value = self._locked(self._get, key, self._hash(key))
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        key = self._encode_key(key)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self._slot_header.size + len(key) + len(value) > self.slot_size:
+            self.oversized += 1
+            if self.oversized == 1:
+                logger.warning('The value for %r is %d bytes which is too large '
+                               'for the %d byte slots in %s. Further values that '
+                               'are too large are only counted in '
+                               'MMapCache.oversized.' % (key, len(value),
+                                                         self.slot_size, self.path))
+            return False
+        self._locked(self._set, key, self._hash(key), value,
+                     self._get_expires(timeout))
+        return True
+
+    def delete(self, key):
+        key = self._encode_key(key)
+        self._locked(self._delete, key, self._hash(key))
+
+    def clear(self):
+        self._locked(self._clear)
+
+
+class Cache(object):
+    """
+    An extension for Namake that attaches a cache backend
+    to the application as ``app.cache``.
+
+    The backend is set by import path with the ``CACHE_BACKEND`` setting
+    and the keyword arguments for the backend with ``CACHE_OPTIONS``. For
+    example, to share a cache between all worker processes on a host::
+
+        CACHE_BACKEND = 'namake.cache.MMapCache'
+        CACHE_OPTIONS = {'path': '/tmp/myapp.cache', 'slots': 4096,
+                         'slot_size': 65536}
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from .utils.module import import_string
+
+        self.app = app
+        app.cache = self
+        app.extensions['cache'] = self
+
+        app.config.setdefault('CACHE_BACKEND', 'namake.cache.SimpleCache')
+        app.config.setdefault('CACHE_OPTIONS', {})
+
+        backend = app.config['CACHE_BACKEND']
+        if isinstance(backend, basestring):
+            backend = import_string(backend)
+        self.backend = backend(**app.config['CACHE_OPTIONS'])
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, timeout=None):
+        return self.backend.set(key, value, timeout)
+
+    def delete(self, key):
+        return self.backend.delete(key)
+
+    def clear(self):
+        return self.backend.clear()
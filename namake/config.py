@@ -65,6 +65,9 @@ class Config(dict):
     def __init__(self, root_path, defaults=None):
         dict.__init__(self, defaults or {})
         self.root_path = root_path
+        # Maps the files the configuration was loaded from to
+        # the method used to load them so they can be reloaded.
+        self.loaded_files = {}
 
     def from_envvar(self, variable_name, silent=False):
         """Loads a configuration from an environment variable pointing to
@@ -112,6 +115,7 @@ class Config(dict):
             e.strerror = 'Unable to load configuration file (%s)' % e.strerror
             raise
         self.from_object(d)
+        self.loaded_files[filename] = 'from_pyfile'
         return True
 
     def from_object(self, obj):
@@ -179,6 +183,7 @@ class Config(dict):
                         break
                     except ValueError:
                         pass
+        self.loaded_files[filename] = 'from_inifile'
 
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, dict.__repr__(self))
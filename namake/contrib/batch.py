@@ -0,0 +1,191 @@
+import re
+import sys
+import threading
+
+from namake.utils.decorators import locked_cached_property
+
+__all__ = (
+    'Batch',
+)
+
+# Environ keys that are set from each sub-request rather
+# than copied from the batch request.
+_SUBREQUEST_KEYS = (
+    'PATH_INFO',
+    'QUERY_STRING',
+    'REQUEST_METHOD',
+    'CONTENT_LENGTH',
+    'CONTENT_TYPE',
+    'wsgi.input',
+)
+
+class Batch(object):
+    """
+    An extension for Namake that adds an endpoint for dispatching
+    several requests in a single HTTP request.
+
+    The endpoint, at the ``BATCH_URL`` setting, accepts a JSON list of
+    sub-requests, or an object with the list as ``requests`` and an
+    optional ``parallel`` flag::
+
+        {"parallel": true,
+         "requests": [
+            {"path": "/api/user"},
+            {"method": "POST", "path": "/api/items",
+             "headers": {"Content-Type": "application/json"},
+             "body": "{\"name\": \"foo\"}"}
+         ]}
+
+    Each sub-request is dispatched in-process through the application's
+    routing table and the responses are returned as a JSON list of
+    objects with ``status``, ``headers`` and ``body`` keys.
+
+    The before_request functions are run for each sub-request, so checks
+    that depend on the request, like requiring a login for some paths,
+    apply to sub-requests just as they do to normal requests. Sub-requests
+    share the batch request's WSGI environ, so state stored there, like
+    the beaker session, is loaded once and shared by all of them. The
+    after_request functions are run once, for the batch request, so the
+    session is only saved once.
+
+    Parallel sub-requests are run on a pool of ``BATCH_THREADS`` threads
+    so they should not modify shared state such as the session.
+
+    The batch route is added when the extension is initialized so the
+    extension should be registered with ``on_request=True`` when it is
+    lazy loaded.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.batch = self
+        app.extensions['batch'] = self
+
+        app.config.setdefault('BATCH_URL', r'^/_batch$')
+        app.config.setdefault('BATCH_MAX_REQUESTS', 20)
+        app.config.setdefault('BATCH_THREADS', 1)
+
+        self.route = re.compile(app.config['BATCH_URL'])
+        self._local = threading.local()
+        app.add_route(app.config['BATCH_URL'], self.handle_batch, name='batch')
+
+    @locked_cached_property
+    def pool(self):
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(self.app.config['BATCH_THREADS'])
+
+    def handle_batch(self, request):
+        """
+        The controller for the batch endpoint.
+        """
+        import json
+        from webob import exc
+
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            raise exc.HTTPBadRequest('The request body is not valid JSON.')
+
+        parallel = False
+        if isinstance(data, dict):
+            parallel = bool(data.get('parallel'))
+            data = data.get('requests')
+        if not isinstance(data, list):
+            raise exc.HTTPBadRequest('Expected a list of requests.')
+        if len(data) > self.app.config['BATCH_MAX_REQUESTS']:
+            raise exc.HTTPRequestEntityTooLarge('Too many requests.')
+
+        subrequests = [self.make_subrequest(request, spec) for spec in data]
+
+        # Never wait on the pool from one of its own threads, since the
+        # tasks may have no free thread to run on.
+        if (parallel and self.app.config['BATCH_THREADS'] > 1 and
+                not getattr(self._local, 'in_pool', False)):
+            responses = self.pool.map(self._dispatch_in_pool, subrequests)
+        else:
+            responses = map(self.dispatch, subrequests)
+
+        body = json.dumps([self.serialize_response(sub, response)
+                           for sub, response in zip(subrequests, responses)])
+        return body, 200, [('Content-Type', 'application/json')]
+
+    def make_subrequest(self, request, spec):
+        """
+        Creates a request object for the given sub-request specification
+        based on the batch request.
+        """
+        from webob import exc
+
+        if not isinstance(spec, dict) or not spec.get('path'):
+            raise exc.HTTPBadRequest('Each request must have a path.')
+
+        environ = dict((key, value) for key, value in request.environ.iteritems()
+                       if key not in _SUBREQUEST_KEYS and
+                          not key.startswith('webob.'))
+
+        # Share the attributes set on the batch request, such as
+        # request.app, with the sub-request.
+        environ['webob.adhoc_attrs'] = dict(
+            request.environ.get('webob.adhoc_attrs', {}))
+
+        path = spec['path']
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        subrequest = self.app.request_class.blank(path, environ=environ,
+                                                  headers=spec.get('headers'))
+        subrequest.method = spec.get('method', 'GET').upper()
+
+        # Nested batches would get around BATCH_MAX_REQUESTS.
+        if self.route.match(subrequest.path_info):
+            raise exc.HTTPBadRequest('Batch requests can\'t be nested.')
+
+        body = spec.get('body')
+        if body is not None:
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            subrequest.body = body
+
+        return subrequest
+
+    def dispatch(self, subrequest):
+        """
+        Dispatches a sub-request through the application and returns
+        the response.
+        """
+        try:
+            # Run the before_request functions for each sub-request so
+            # that checks based on the request apply to it.
+            rv = self.app.preprocess_request(subrequest)
+            if rv:
+                return self.app.make_response(subrequest, rv, False)
+            return self.app.dispatch_request(subrequest,
+                                             after_request_funcs=False)
+        except Exception, e:
+            return self.app.handle_exception(subrequest, e, sys.exc_info(),
+                                             after_request_funcs=False)
+
+    def _dispatch_in_pool(self, subrequest):
+        self._local.in_pool = True
+        try:
+            return self.dispatch(subrequest)
+        finally:
+            self._local.in_pool = False
+
+    def serialize_response(self, subrequest, response):
+        """
+        Converts a sub-request response to a dictionary
+        that can be serialized as JSON.
+        """
+        # Call the response as a WSGI application so that responses
+        # which generate their body when called, like HTTP exceptions,
+        # are rendered.
+        response = subrequest.get_response(response)
+        return {
+            'status': response.status_int,
+            'headers': response.headerlist,
+            'body': response.body.decode(response.charset or 'utf-8', 'replace'),
+        }
@@ -22,21 +22,39 @@ def run_devserver(app):
                        help="Don't serve static files.")
     parser.add_argument('--noreload', dest="reload", action='store_false', default=True,
                        help="Don't reload code when the files are updated.")
+    parser.add_argument('--fullreload', dest="fullreload", action='store_true', default=False,
+                       help="Restart the server process when files are updated "
+                            "rather than reloading only the changed files.")
     parser.add_argument('--nodebugger', dest="debugger", action='store_false', default=True,
                        help="Don't show debug responses when errors occur.")
 
     config = parser.parse_args()
     
     app.config.setdefault('STATIC_FOLDER', 'static')
+    app.config.setdefault('STATIC_URL', '/static/')
     static_folder = app.config['STATIC_FOLDER']
+    static_url = app.config['STATIC_URL']
+
+    if config.static and not app.config.get('STATIC_SERVE'):
+        # The source files are served as they are, so static URLs
+        # must not point to the fingerprinted copies. This is set even
+        # if the static extension has already set the default since
+        # the setting is read every time a URL is resolved.
+        app.config['STATIC_FINGERPRINT'] = False
+
+    if config.reload and not config.fullreload:
+        # Reload changed modules, templates and config files in
+        # the running process rather than restarting it.
+        from namake.contrib.reloader import HotReloader
+        HotReloader(app).start()
 
     run_simple(
         hostname=config.hostname, 
         port=config.port,
         application=app,
-        use_reloader=config.reload,
+        use_reloader=config.reload and config.fullreload,
         use_debugger=config.debugger,
         static_files={
-            '/%s' % static_folder: os.path.join(app.root_path, static_folder) 
+            static_url.rstrip('/'): os.path.join(app.root_path, static_folder)
         } if config.static else None
     )
@@ -0,0 +1,119 @@
+"""
+The fragment cache extension for Jinja2.
+
+This is kept separate from :mod:`namake.contrib.jinja2_templates` so
+that importing that module doesn't import Jinja2 until the template
+environment is created.
+"""
+
+from threading import Lock
+
+from jinja2 import nodes, Markup
+from jinja2.ext import Extension
+
+__all__ = (
+    'FragmentCacheExtension',
+)
+
+class FragmentCacheExtension(Extension):
+    """
+    A Jinja2 extension that adds a ``cache`` tag for caching rendered
+    template fragments. Add it to the ``JINJA2_EXTENSIONS`` setting as
+    ``namake.contrib.jinja2_fragments.FragmentCacheExtension``.
+
+    The tag takes a key and optionally a timeout in seconds and a list
+    of tags that can be used to invalidate the fragment later::
+
+        {% cache "sidebar", 300, ["categories"] %}
+            ...
+        {% endcache %}
+
+    Fragments are stored in ``app.cache`` if the cache extension is
+    registered. Changing the ``JINJA2_FRAGMENT_CACHE_VERSION`` setting
+    invalidates all cached fragments, and ``app.jinja2.invalidate_fragments()``
+    invalidates all fragments cached with a given tag.
+
+    The number of cache hits and misses is kept in the environment's
+    ``fragment_cache_stats`` dict.
+    """
+
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        self._stats_lock = Lock()
+        environment.extend(
+            fragment_cache=None,
+            fragment_cache_prefix='fragment',
+            fragment_cache_version=1,
+            fragment_cache_stats={'hits': 0, 'misses': 0},
+            invalidate_fragments=self.invalidate,
+        )
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        # The key, followed by an optional timeout and list of tags.
+        args = [parser.parse_expression()]
+        for i in range(2):
+            if parser.stream.skip_if('comma'):
+                args.append(parser.parse_expression())
+            else:
+                args.append(nodes.Const(None))
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _tag_key(self, tag):
+        return u'%s:tag:%s' % (self.environment.fragment_cache_prefix, tag)
+
+    def _tag_version(self, cache, tag):
+        version = cache.get(self._tag_key(tag))
+        if version is None:
+            version = self._new_tag_version(cache, tag)
+        return version
+
+    def _new_tag_version(self, cache, tag):
+        from uuid import uuid4
+        version = uuid4().hex[:8]
+        cache.set(self._tag_key(tag), version, 0)
+        return version
+
+    def _make_key(self, cache, key, tags):
+        env = self.environment
+        parts = [env.fragment_cache_prefix,
+                 unicode(env.fragment_cache_version),
+                 unicode(key)]
+        for tag in tags or ():
+            parts.append(u'%s=%s' % (tag, self._tag_version(cache, tag)))
+        return u':'.join(parts)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.environment.fragment_cache_stats[name] += 1
+
+    def _cache(self, key, timeout, tags, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        key = self._make_key(cache, key, tags)
+        rv = cache.get(key)
+        if rv is not None:
+            self._count('hits')
+            return Markup(rv)
+
+        self._count('misses')
+        rv = caller()
+        cache.set(key, unicode(rv), timeout)
+        return rv
+
+    def invalidate(self, *tags):
+        """
+        Invalidates all fragments cached with any of the given tags.
+        """
+        cache = self.environment.fragment_cache
+        if cache is not None:
+            for tag in tags:
+                self._new_tag_version(cache, tag)
@@ -25,6 +25,9 @@ class Jinja2(object):
         app.config.setdefault('JINJA2_TEMPLATE_DIRS', [os.path.join(app.root_path, 'templates')])
         app.config.setdefault('JINJA2_EXTENSIONS', ['jinja2.ext.autoescape', 'jinja2.ext.with_'])
         app.config.setdefault('JINJA2_AUTOESCAPE_FILE_EXTENSIONS', ['.html', '.htm', '.xml', '.xhtml'])
+        app.config.setdefault('JINJA2_BYTECODE_CACHE', False)
+        app.config.setdefault('JINJA2_FRAGMENT_CACHE_VERSION', 1)
+        app.config.setdefault('JINJA2_GLOBALS', {})
 
         if handle_errors:
             app.register_error_handler(404, self.handle_404)
@@ -39,11 +42,37 @@ class Jinja2(object):
             loader = FileSystemLoader(self.app.config['JINJA2_TEMPLATE_DIRS'])
             autoescape = self.select_jinja_autoescape
 
+            # Store compiled templates in the application's cache so
+            # that they can be shared between processes. The bytecode is
+            # checked against the template source when it's loaded so it
+            # never needs to expire.
+            bytecode_cache = None
+            if self.app.config['JINJA2_BYTECODE_CACHE']:
+                from jinja2 import MemcachedBytecodeCache
+                cache = self.app.extensions.get('cache')
+                if cache is None:
+                    raise RuntimeError('The JINJA2_BYTECODE_CACHE setting requires '
+                                       'the cache extension, namake.cache.Cache.')
+                bytecode_cache = MemcachedBytecodeCache(cache, timeout=0)
+
             self._jinja2_env = Environment(
                 extensions=extensions,
                 loader=loader,
                 autoescape=autoescape,
+                bytecode_cache=bytecode_cache,
             )
+            self._jinja2_env.globals.update(self.app.config['JINJA2_GLOBALS'])
+
+            # Store cached fragments in the application's cache if there
+            # is one, otherwise fall back to a cache in the current process.
+            if hasattr(self._jinja2_env, 'fragment_cache'):
+                cache = self.app.extensions.get('cache')
+                if cache is None:
+                    from namake.cache import SimpleCache
+                    cache = SimpleCache()
+                self._jinja2_env.fragment_cache = cache
+                self._jinja2_env.fragment_cache_version = \
+                    self.app.config['JINJA2_FRAGMENT_CACHE_VERSION']
         return self._jinja2_env
 
     def select_jinja_autoescape(self, filename):
@@ -59,6 +88,15 @@ class Jinja2(object):
     def update_template_context(self, context):
         pass
 
+    def invalidate_fragments(self, *tags):
+        """
+        Invalidates all fragments cached with any of the given tags.
+        """
+        if not hasattr(self.env, 'invalidate_fragments'):
+            raise RuntimeError('Fragments can only be invalidated if '
+                               'namake.contrib.jinja2_fragments.FragmentCacheExtension '
+                               'is in the JINJA2_EXTENSIONS setting.')
+        self.env.invalidate_fragments(*tags)
 
     def handle_404(self, e):
         """
@@ -0,0 +1,228 @@
+import os
+import re
+import sys
+import time
+import errno
+import random
+import threading
+
+from namake.app import logger
+
+__all__ = (
+    'Profiler',
+)
+
+class Sampler(threading.Thread):
+    """
+    A thread that periodically records the stack of another thread.
+    When stopped, the samples are passed to `callback` along with the
+    route of the request from this thread so that the request thread
+    doesn't wait on saving them.
+    """
+
+    def __init__(self, thread_id, interval, callback):
+        threading.Thread.__init__(self, name='namake-profiler')
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.callback = callback
+        self.route = None
+        self.stacks = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self._stopped.wait(self.interval)
+            if self._stopped.is_set():
+                break
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append('%s:%s' % (frame.f_globals.get('__name__', '?'),
+                                            frame.f_code.co_name))
+                    frame = frame.f_back
+                stack = ';'.join(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            # Don't keep a reference to the frame while waiting.
+            frame = None
+
+        try:
+            self.callback(self.route, self.stacks)
+        except Exception:
+            logger.exception('Error saving the profile for %s' % self.route)
+
+    def stop(self, route):
+        self.route = route
+        self._stopped.set()
+
+
+class Profiler(object):
+    """
+    An extension for Namake that profiles selected requests by sampling
+    the stack of the thread handling the request.
+
+    Requests are profiled if ``PROFILER_ENABLED`` is set, at random with a
+    probability of ``PROFILER_SAMPLE_RATE``, or if the request has a header,
+    ``X-Namake-Profile`` by default, whose value was created with
+    :meth:`make_header_value` in the last ``PROFILER_HEADER_MAX_AGE`` seconds.
+    The header requires the ``SECRET_KEY`` setting.
+
+    Samples are aggregated per route and written to the
+    ``PROFILER_OUTPUT_DIR`` directory in the collapsed stack format that
+    ``flamegraph.pl`` expects, one ``<route>-<hash>.collapsed`` file per
+    route. The samples are written by the sampling thread rather than the
+    thread handling the request, and are merged with the samples already
+    in the file while it is locked so that all the worker processes on a
+    host can share the output directory.
+
+    The extension wraps the wsgi application so it should be registered
+    with ``on_request=True`` when it is lazy loaded.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.profiler = self
+        app.extensions['profiler'] = self
+
+        app.config.setdefault('PROFILER_ENABLED', False)
+        app.config.setdefault('PROFILER_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILER_HEADER', 'X-Namake-Profile')
+        app.config.setdefault('PROFILER_HEADER_MAX_AGE', 300)
+        app.config.setdefault('PROFILER_INTERVAL', 0.005)
+        app.config.setdefault('PROFILER_OUTPUT_DIR',
+                              os.path.join(app.root_path, 'profiles'))
+
+        self._lock = threading.Lock()
+        self._header_key = 'HTTP_' + \
+            app.config['PROFILER_HEADER'].upper().replace('-', '_')
+
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        sampler = Sampler(threading.current_thread().ident,
+                          self.app.config['PROFILER_INTERVAL'], self.save)
+        sampler.start()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            sampler.stop(environ.get('namake.route', 'unmatched'))
+
+    def should_profile(self, environ):
+        """
+        Returns `True` if the request should be profiled.
+        """
+        config = self.app.config
+        if config['PROFILER_ENABLED']:
+            return True
+        rate = config['PROFILER_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            return True
+        value = environ.get(self._header_key)
+        if value:
+            return self.check_header_value(value)
+        return False
+
+    def _sign(self, timestamp):
+        import hmac
+        from hashlib import sha1
+
+        secret_key = self.app.config['SECRET_KEY']
+        if not secret_key:
+            return None
+        return hmac.new(secret_key, timestamp, sha1).hexdigest()
+
+    def make_header_value(self):
+        """
+        Returns a signed value for the profiler header that
+        can be used to profile a request.
+        """
+        timestamp = str(int(time.time()))
+        signature = self._sign(timestamp)
+        if signature is None:
+            raise RuntimeError('The SECRET_KEY setting is required to '
+                               'sign the profiler header.')
+        return '%s:%s' % (timestamp, signature)
+
+    def check_header_value(self, value):
+        """
+        Returns `True` if the value of the profiler header
+        is valid and has not expired.
+        """
+        timestamp, sep, signature = value.partition(':')
+        try:
+            age = time.time() - int(timestamp)
+        except ValueError:
+            return False
+        if age > self.app.config['PROFILER_HEADER_MAX_AGE']:
+            return False
+        expected = self._sign(timestamp)
+        # Compare in constant time.
+        if expected is None or len(expected) != len(signature):
+            return False
+        result = 0
+        for x, y in zip(expected, signature):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+    def get_filename(self, route):
+        """
+        Returns the output file for the given route name or pattern.
+        A hash of the route is included so that different patterns
+        never share a file.
+        """
+        from hashlib import md5
+
+        slug = re.sub(r'[^\w.-]+', '_', route).strip('_.') or 'route'
+        filename = '%s-%s.collapsed' % (slug, md5(route).hexdigest()[:8])
+        return os.path.join(self.app.config['PROFILER_OUTPUT_DIR'], filename)
+
+    def save(self, route, stacks):
+        """
+        Adds the samples for a request to the samples in the
+        given route's output file.
+        """
+        import fcntl
+
+        if not stacks:
+            return
+        if isinstance(route, unicode):
+            route = route.encode('utf-8')
+
+        with self._lock:
+            # Other processes may create the directory at the same time.
+            try:
+                os.makedirs(self.app.config['PROFILER_OUTPUT_DIR'])
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            with open(self.get_filename(route), 'a+') as f:
+                # Lock the file so that samples from other
+                # processes aren't lost.
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    totals = {}
+                    for line in f:
+                        stack, sep, count = line.rstrip('\n').rpartition(' ')
+                        if stack and count.isdigit():
+                            totals[stack] = int(count)
+                    for stack, count in stacks.iteritems():
+                        totals[stack] = totals.get(stack, 0) + count
+
+                    f.seek(0)
+                    f.truncate()
+                    for stack, count in sorted(totals.iteritems()):
+                        f.write('%s %d\n' % (stack, count))
+                    f.flush()
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,222 @@
+import os
+import sys
+import time
+import types
+import threading
+
+from namake.app import logger
+
+__all__ = (
+    'HotReloader',
+)
+
+class HotReloader(threading.Thread):
+    """
+    A thread that polls the application's code, templates and
+    configuration files for changes and reloads only what changed
+    without restarting the process.
+
+    -   Changed modules under the application's root path are reloaded,
+        along with the modules that imported objects from them, as in
+        ``from helpers import format_date``, so that those modules don't
+        keep using the old objects. Controllers imported from any of the
+        reloaded modules are removed from the application's controller
+        cache so that they are imported again on the next request.
+    -   Changed templates are removed from the Jinja2 template cache.
+    -   Changed configuration files are loaded again.
+
+    Modules that define the application object itself, like the script
+    used to run the development server, can't be reloaded this way and
+    require restarting the server, as do changes to modules that they
+    import objects from.
+    """
+
+    def __init__(self, app, interval=1):
+        threading.Thread.__init__(self, name='namake-reloader')
+        self.daemon = True
+        self.app = app
+        self.interval = interval
+
+    def run(self):
+        mtimes = self.get_mtimes()
+        while True:
+            time.sleep(self.interval)
+            new_mtimes = self.get_mtimes()
+            changed = sorted(filename for filename, mtime in new_mtimes.iteritems()
+                             if mtimes.get(filename, mtime) != mtime)
+            mtimes = new_mtimes
+
+            # Reload all the changed modules together so that they're
+            # reloaded in dependency order.
+            modules = [self._files[filename][1] for filename in changed
+                       if self._files[filename][0] == 'module']
+            if modules:
+                try:
+                    self.reload_modules(modules)
+                except Exception:
+                    logger.exception('Error reloading %s' % ', '.join(modules))
+
+            for filename in changed:
+                if self._files[filename][0] == 'module':
+                    continue
+                try:
+                    self.reload(filename)
+                except Exception:
+                    logger.exception('Error reloading %s' % filename)
+
+    def iter_files(self):
+        """
+        Yields a tuple of (filename, kind, name) for each file that is
+        watched, where `kind` is one of "module", "template" or "config".
+        """
+        for name, module in self.get_modules().iteritems():
+            filename = module.__file__
+            if filename.endswith(('.pyc', '.pyo')):
+                filename = filename[:-1]
+            yield os.path.abspath(filename), 'module', name
+
+        for template_dir in self.app.config.get('JINJA2_TEMPLATE_DIRS', ()):
+            for dirpath, dirnames, filenames in os.walk(template_dir):
+                for filename in filenames:
+                    filename = os.path.join(dirpath, filename)
+                    name = os.path.relpath(filename, template_dir)
+                    yield filename, 'template', name.replace(os.sep, '/')
+
+        for filename in self.app.config.loaded_files:
+            yield filename, 'config', filename
+
+    def get_modules(self):
+        """
+        Returns a dict of the loaded modules under the
+        application's root path keyed by name.
+        """
+        root_path = self.app.root_path + os.sep
+        modules = {}
+        for name, module in sys.modules.items():
+            filename = getattr(module, '__file__', None)
+            if filename and os.path.abspath(filename).startswith(root_path):
+                modules[name] = module
+        return modules
+
+    def imports_from(self, module, other):
+        """
+        Returns `True` if `module` holds objects that were imported from
+        the `other` module, as in ``from other import name``. Modules
+        that only import `other` itself don't need reloading since
+        reloading `other` updates the module object in place.
+        """
+        other_vars = vars(other)
+        other_name = other.__name__
+        for key, value in vars(module).items():
+            if key.startswith('__') or isinstance(value, types.ModuleType):
+                continue
+            value_module = getattr(value, '__module__', None)
+            if value_module == other_name:
+                return True
+            # Objects without a __module__, like constants, are matched
+            # by name since that is how they were imported.
+            if (value_module is None and value is not None and
+                    not isinstance(value, bool) and
+                    other_vars.get(key, other_vars) is value):
+                return True
+        return False
+
+    def get_mtimes(self):
+        mtimes = {}
+        self._files = {}
+        for filename, kind, name in self.iter_files():
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime
+            except OSError:
+                continue
+            self._files[filename] = (kind, name)
+        return mtimes
+
+    def reload(self, filename):
+        kind, name = self._files[filename]
+        getattr(self, 'reload_%s' % kind)(name)
+
+    def reload_module(self, name):
+        self.reload_modules([name])
+
+    def reload_modules(self, names):
+        """
+        Reloads the given modules and the modules that imported objects
+        from them, directly or indirectly, in dependency order.
+        """
+        modules = self.get_modules()
+
+        # Find the modules that depend on the changed modules before
+        # anything is reloaded, while they still hold the old objects.
+        deps = {}
+        pending = [name for name in names if name in modules]
+        to_reload = set(pending)
+        while pending:
+            changed = pending.pop()
+            for name, module in modules.iteritems():
+                if name != changed and self.imports_from(module, modules[changed]):
+                    deps.setdefault(name, set()).add(changed)
+                    if name not in to_reload:
+                        to_reload.add(name)
+                        pending.append(name)
+
+        # Reload each module after the modules it imports from. Modules
+        # that import from each other are reloaded in name order.
+        order = []
+        visiting = set()
+        def visit(name):
+            if name in visiting:
+                return
+            visiting.add(name)
+            for dep in sorted(deps.get(name, ())):
+                visit(dep)
+            order.append(name)
+        for name in sorted(to_reload):
+            visit(name)
+
+        reloaded = []
+        try:
+            for name in order:
+                module = modules[name]
+                if name == '__main__' or any(value is self.app
+                                             for value in vars(module).itervalues()):
+                    logger.warning(' * %s defines the application and can\'t be '
+                                   'reloaded. Restart the server to apply changes.' %
+                                   name)
+                    continue
+                reload(module)
+                reloaded.append(name)
+        finally:
+            # Remove controllers imported from the reloaded modules
+            # so that they're imported again from the new modules.
+            controller_cache = self.app.controller_cache
+            for path, controller in controller_cache.items():
+                if (isinstance(path, basestring) and
+                        getattr(controller, '__module__', None) in reloaded):
+                    controller_cache.pop(path, None)
+
+        for name in reloaded:
+            logger.info(' * Reloaded module %s' % name)
+
+    def reload_template(self, name):
+        # Only bother if the Jinja2 environment has been created.
+        jinja2 = dict.get(self.app.extensions, 'jinja2')
+        env = jinja2 and jinja2.__dict__.get('env')
+        if env is None or env.cache is None:
+            return
+        for key in env.cache.keys():
+            # Newer versions of Jinja2 key the cache with a
+            # (loader, name) tuple rather than the name.
+            if (key[1] if isinstance(key, tuple) else key) == name:
+                try:
+                    del env.cache[key]
+                except KeyError:
+                    pass
+
+        logger.info(' * Reloaded template %s' % name)
+
+    def reload_config(self, filename):
+        config = self.app.config
+        getattr(config, config.loaded_files[filename])(filename)
+
+        logger.info(' * Reloaded config file %s' % filename)
@@ -1,5 +1,3 @@
-from beaker.middleware import SessionMiddleware
-
 class Sessions(object):
     """
     An extension for Namake that provides support for sessions
@@ -11,6 +9,10 @@ class Sessions(object):
             self.init_app(app)
     
     def init_app(self, app):
+        # Import beaker here so that it isn't loaded until the
+        # extension is actually initialized.
+        from beaker.middleware import SessionMiddleware
+
         self.app = app
         app.sessions = self
         app.extensions['sessions'] = self
@@ -0,0 +1,196 @@
+import os
+import re
+
+from namake.utils.decorators import locked_cached_property
+
+__all__ = (
+    'Static',
+    'build_static',
+)
+
+# File extensions that are worth compressing ahead of time.
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.html', '.htm', '.xml',
+                           '.svg', '.txt', '.ico', '.map')
+
+def build_static(source_dir, output_dir, manifest_name='manifest.json'):
+    """
+    Copies every file under `source_dir` to `output_dir` with a hash of
+    its contents added to the filename, as in ``css/site.3f2a9c1b7e4d.css``.
+    A gzip compressed copy is also written next to compressible files.
+
+    A manifest mapping the original filenames to the fingerprinted
+    filenames is written to `manifest_name` in `output_dir` and returned.
+    """
+    import json
+    import gzip
+    from hashlib import md5
+    from cStringIO import StringIO
+
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            name = os.path.relpath(source, source_dir).replace(os.sep, '/')
+
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            base, ext = os.path.splitext(name)
+            hashed_name = '%s.%s%s' % (base, md5(data).hexdigest()[:12], ext)
+            manifest[name] = hashed_name
+
+            dest = os.path.join(output_dir, *hashed_name.split('/'))
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            with open(dest, 'wb') as f:
+                f.write(data)
+
+            if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                # Use a fixed mtime so that builds are reproducible.
+                buf = StringIO()
+                gz = gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0)
+                try:
+                    gz.write(data)
+                finally:
+                    gz.close()
+                if len(buf.getvalue()) < len(data):
+                    with open(dest + '.gz', 'wb') as f:
+                        f.write(buf.getvalue())
+
+    with open(os.path.join(output_dir, manifest_name), 'wb') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class Static(object):
+    """
+    An extension for Namake that resolves static file URLs to the
+    fingerprinted filenames created by :func:`build_static`.
+
+    :meth:`url`, also available in Jinja2 templates as ``static_url()``,
+    returns the URL of a static file. The manifest is read from the
+    ``STATIC_BUILD_FOLDER`` once, the first time a URL is resolved, and
+    files that aren't in the manifest resolve to their original name.
+    If ``STATIC_FINGERPRINT`` is `False`, as it is under the development
+    server, the manifest isn't used and every file resolves to its
+    original name.
+
+    If ``STATIC_SERVE`` is set the extension also serves static files at
+    ``STATIC_URL``. Fingerprinted files never change so they are served
+    with headers that let browsers cache them for a year without
+    revalidating them. Other files must be revalidated, so they are
+    served with ``ETag`` and ``Last-Modified`` headers and conditional
+    requests for them get a ``304 Not Modified`` response.
+
+    The static_url() template function is added to the ``JINJA2_GLOBALS``
+    setting so this extension must be initialized before the Jinja2
+    environment is first used.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.static = self
+        app.extensions['static'] = self
+
+        app.config.setdefault('STATIC_FOLDER', 'static')
+        app.config.setdefault('STATIC_BUILD_FOLDER', 'static-build')
+        app.config.setdefault('STATIC_MANIFEST', 'manifest.json')
+        app.config.setdefault('STATIC_URL', '/static/')
+        app.config.setdefault('STATIC_FINGERPRINT', True)
+        app.config.setdefault('STATIC_SERVE', False)
+        app.config.setdefault('STATIC_MAX_AGE', 31536000)
+
+        app.config.setdefault('JINJA2_GLOBALS', {})['static_url'] = self.url
+
+        if app.config['STATIC_SERVE']:
+            app.add_route('^%s(?P<filename>.+)$' % re.escape(app.config['STATIC_URL']),
+                          self.serve, name='static')
+
+    @property
+    def static_folder(self):
+        return os.path.join(self.app.root_path, self.app.config['STATIC_FOLDER'])
+
+    @property
+    def build_folder(self):
+        return os.path.join(self.app.root_path, self.app.config['STATIC_BUILD_FOLDER'])
+
+    @locked_cached_property
+    def manifest(self):
+        import json
+
+        filename = os.path.join(self.build_folder, self.app.config['STATIC_MANIFEST'])
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'rb') as f:
+            return json.load(f)
+
+    @locked_cached_property
+    def fingerprinted(self):
+        return frozenset(self.manifest.itervalues())
+
+    def build(self):
+        """
+        Builds the fingerprinted files for the application's static
+        folder and reloads the manifest.
+        """
+        manifest = build_static(self.static_folder, self.build_folder,
+                                self.app.config['STATIC_MANIFEST'])
+        self.__dict__.pop('manifest', None)
+        self.__dict__.pop('fingerprinted', None)
+        return manifest
+
+    def url(self, filename):
+        """
+        Returns the URL for the given static file.
+        """
+        if self.app.config['STATIC_FINGERPRINT']:
+            filename = self.manifest.get(filename, filename)
+        return self.app.config['STATIC_URL'] + filename
+
+    def serve(self, request, filename):
+        """
+        A controller that serves static files.
+        """
+        import mimetypes
+        from webob import exc
+
+        if filename in self.fingerprinted:
+            folder = self.build_folder
+            cache_control = 'public, max-age=%d, immutable' % \
+                self.app.config['STATIC_MAX_AGE']
+        else:
+            folder = self.static_folder
+            cache_control = 'no-cache'
+
+        path = os.path.normpath(os.path.join(folder, *filename.split('/')))
+        if not path.startswith(folder + os.sep) or not os.path.isfile(path):
+            raise exc.HTTPNotFound()
+
+        content_type, encoding = mimetypes.guess_type(path)
+        response = self.app.response_class(
+            content_type=content_type or 'application/octet-stream',
+            conditional_response=True)
+        response.cache_control = cache_control
+
+        if filename in self.fingerprinted:
+            response.vary = ('Accept-Encoding',)
+            if ('gzip' in request.accept_encoding and
+                    os.path.isfile(path + '.gz')):
+                path += '.gz'
+                response.content_encoding = 'gzip'
+
+        with open(path, 'rb') as f:
+            response.body = f.read()
+
+        # The gzipped copy is a different representation
+        # so it needs its own validator.
+        stat = os.stat(path)
+        response.etag = '%x-%x%s' % (int(stat.st_mtime), stat.st_size,
+                                     '-gzip' if response.content_encoding else '')
+        response.last_modified = stat.st_mtime
+        return response
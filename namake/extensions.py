@@ -0,0 +1,123 @@
+"""
+The extension registry for Namake.
+
+Extensions can be registered by import path so that neither the
+extension module nor any libraries it depends on are imported
+until the extension is actually used.
+"""
+
+from threading import RLock, local
+
+__all__ = (
+    'ExtensionRegistry',
+)
+
+class ExtensionRegistry(dict):
+    """
+    Works like a dict mapping extension names to initialized extension
+    objects but also keeps track of extensions that have been registered
+    by import path and not yet loaded.
+
+    Extensions are registered like so::
+
+        app.extensions.register('jinja2',
+            'namake.contrib.jinja2_templates.Jinja2', handle_errors=False)
+        app.extensions.register('sessions',
+            'namake.contrib.sessions.Sessions', on_request=True)
+
+    A pending extension is imported and its ``init_app`` method called the
+    first time it is looked up, either via ``app.extensions[name]`` or as
+    an attribute of the application (``app.jinja2``). Extensions that
+    need to hook into every request, by adding wsgi middleware, request
+    hooks or error handlers, must be registered with ``on_request=True``
+    so that they are loaded just before the first request is handled.
+    Otherwise requests handled before the extension is first used don't
+    go through its hooks.
+
+    Extensions that are initialized directly, as in ``Jinja2(app)``, add
+    themselves to the registry as before.
+    """
+
+    def __init__(self, app):
+        dict.__init__(self)
+        self.app = app
+        self._pending = {}
+        self._lock = RLock()
+        # The number of extensions being loaded by each thread. Loading
+        # an extension can load others so this is a count, not a flag.
+        self._local = local()
+
+    def register(self, name, import_path, on_request=False, **options):
+        """
+        Registers the extension at the given import path under `name`.
+        Any extra keyword arguments are passed on to the extension's
+        ``init_app`` method.
+        """
+        with self._lock:
+            self._pending[name] = (import_path, on_request, options)
+
+    def load(self, name):
+        """
+        Imports and initializes the pending extension with the
+        given name and returns it.
+        """
+        with self._lock:
+            if dict.__contains__(self, name):
+                return dict.__getitem__(self, name)
+
+            pending = self._pending.pop(name)
+            import_path, on_request, options = pending
+
+            self._local.depth = getattr(self._local, 'depth', 0) + 1
+            try:
+                from .utils.module import import_string
+                extension = import_string(import_path)()
+                extension.init_app(self.app, **options)
+            except:
+                # Leave the extension pending so the error is raised
+                # again the next time it is used.
+                self._pending[name] = pending
+                raise
+            finally:
+                self._local.depth -= 1
+
+            # Store the extension under the registered name in case
+            # init_app used a different key.
+            dict.__setitem__(self, name, extension)
+            return extension
+
+    def load_request_extensions(self):
+        """
+        Loads all pending extensions registered with ``on_request=True``.
+        This is called by the application before the first request.
+        """
+        with self._lock:
+            for name, (import_path, on_request, options) in self._pending.items():
+                if on_request:
+                    self.load(name)
+
+    def is_loading(self):
+        """
+        Returns `True` if an extension is currently being
+        initialized by the current thread.
+        """
+        return getattr(self._local, 'depth', 0) > 0
+
+    def __getitem__(self, name):
+        if name in self._pending:
+            return self.load(name)
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return name in self._pending or dict.__contains__(self, name)
+
+    def __repr__(self):
+        return '<%s %s pending=%r>' % (self.__class__.__name__,
+                                       dict.__repr__(self),
+                                       sorted(self._pending))
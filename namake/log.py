@@ -0,0 +1,130 @@
+"""
+The logging module for Namake.
+
+This module defines a logging handler that does all formatting and
+I/O on a background thread and a formatter for structured JSON logs.
+"""
+
+import os
+import logging
+import threading
+import Queue
+
+__all__ = (
+    'AsyncHandler',
+    'JSONFormatter',
+)
+
+# Attributes that every LogRecord has. Any other attributes
+# were passed to the logger with the `extra` argument.
+_RECORD_ATTRS = frozenset(logging.LogRecord(
+    '', logging.INFO, '', 0, '', (), None).__dict__) | frozenset(['message'])
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats log records as a single line JSON object. Any extra
+    attributes passed to the logger, such as the ``route`` and
+    ``latency`` of a request, are included in the object.
+    """
+
+    def format(self, record):
+        import json
+
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.iteritems():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=repr)
+
+
+class AsyncHandler(logging.Handler):
+    """
+    A handler that puts log records on a queue and passes them to
+    another handler on a background thread so that logging never blocks
+    the thread that logs the record on formatting or I/O.
+
+    The queue holds up to `capacity` records. Records logged while it is
+    full are dropped and counted in :attr:`dropped`. Records remaining in
+    the queue are written when the handler is closed, which the logging
+    module does when the interpreter exits.
+
+    :param handler: the handler that formats and writes the records.
+    :param capacity: the maximum number of records in the queue.
+    """
+
+    def __init__(self, handler, capacity=10000):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.capacity = capacity
+        self.dropped = 0
+        self._reported = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def _start(self):
+        # The thread isn't started until the first record is logged
+        # and is started again in processes forked after that.
+        self._queue = Queue.Queue(self.capacity)
+        self._thread = threading.Thread(target=self._run,
+                                        name='namake-logging')
+        self._thread.daemon = True
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            record = queue.get()
+            try:
+                if record is None:
+                    break
+                self.handler.handle(record)
+                self._report_dropped()
+            except Exception:
+                self.handleError(record)
+            finally:
+                queue.task_done()
+
+    def _report_dropped(self):
+        dropped = self.dropped
+        if dropped > self._reported:
+            self.handler.handle(logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                '%d log records were dropped because the queue was full.',
+                (dropped - self._reported,), None))
+            self._reported = dropped
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Waits until all records in the queue have been written.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.join()
+        self.handler.flush()
+
+    def close(self):
+        """
+        Writes the records remaining in the queue and stops the thread.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._pid = None
+        self.handler.close()
+        logging.Handler.close(self)